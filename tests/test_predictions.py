@@ -2,6 +2,7 @@
 Testing the prediciton tool
 """
 import subprocess
+import pytest
 import numpy as np
 import whereistheplanet.whereistheplanet as witp
 
@@ -24,6 +25,159 @@ def test_cmd_line():
     """
     subprocess.run(['whereistheplanet', 'betpicb', '-t', '2022-01-01'])
 
+def test_orbit_kernels():
+    """
+    Test the numba kernels against orbitize.kepler.calc_orbit and numpy on random orbits,
+    including highly eccentric ones
+    """
+    import orbitize.kepler as kepler
+    import whereistheplanet.orbit_kernels as orbit_kernels
+
+    rng = np.random.default_rng(42)
+    num = 10000
+    sma = rng.uniform(1, 100, num)
+    ecc = np.append(rng.uniform(0, 0.99, num - 100), rng.uniform(0.99, 0.999, 100))
+    inc = rng.uniform(0, np.pi, num)
+    aop = rng.uniform(0, 2 * np.pi, num)
+    pan = rng.uniform(0, 2 * np.pi, num)
+    tau = rng.uniform(0, 1, num)
+    plx = rng.uniform(5, 100, num)
+    mtot = rng.uniform(0.1, 3, num)
+    date_mjd = 60000.5
+    tau_ref_epoch = 58849.
+
+    ras, decs, vzs = kepler.calc_orbit(date_mjd, sma, ecc, inc, aop, pan, tau, plx, mtot, tau_ref_epoch=tau_ref_epoch)
+
+    elements = [np.ascontiguousarray(arr, dtype=np.float32) for arr in (sma, ecc, np.sin(inc), np.cos(inc),
+                                                                       np.sin(aop), np.cos(aop), np.sin(pan),
+                                                                       np.cos(pan), tau, plx, mtot)]
+    numba_ras, numba_decs, numba_vzs = orbit_kernels.calc_orbit_numba(date_mjd, *elements, tau_ref_epoch)
+
+    # float32 tolerance
+    assert np.allclose(numba_ras, ras, rtol=1e-5, atol=0.01)
+    assert np.allclose(numba_decs, decs, rtol=1e-5, atol=0.01)
+    assert np.allclose(numba_vzs, vzs, rtol=1e-4, atol=1e-3)
+
+    medians, stds = orbit_kernels.summarize_numba(numba_ras, numba_decs, numba_vzs)
+
+    ras, decs, vzs = [arr.astype(float) for arr in (numba_ras, numba_decs, numba_vzs)]
+    seps = np.sqrt(ras**2 + decs**2)
+    pas = np.degrees(np.arctan2(ras, decs)) % 360
+    assert np.allclose(medians, [np.median(arr) for arr in (ras, decs, seps, pas, vzs)], rtol=1e-5, atol=1e-4)
+    assert np.allclose(stds, [np.std(arr) for arr in (ras, decs, seps, pas, vzs)], rtol=1e-6)
+
+def test_summarize_wide_orbit():
+    """
+    Test the summary statistics of a wide orbit, where the offsets are large but tightly constrained
+    """
+    import whereistheplanet.orbit_kernels as orbit_kernels
+
+    rng = np.random.default_rng(7)
+    ras = 1e5 + rng.normal(0, 0.01, 100)
+    decs = 3e4 + rng.normal(0, 0.003, 100)
+    vzs = 20 + rng.normal(0, 1e-4, 100)
+
+    medians, stds = orbit_kernels.summarize_numba(ras, decs, vzs)
+
+    seps = np.sqrt(ras**2 + decs**2)
+    pas = np.degrees(np.arctan2(ras, decs)) % 360
+    assert np.allclose(medians, [np.median(arr) for arr in (ras, decs, seps, pas, vzs)], rtol=1e-12)
+    assert np.allclose(stds, [np.std(arr) for arr in (ras, decs, seps, pas, vzs)], rtol=1e-6, atol=0)
+
+def calc_baseline_offsets(planet_name, date_mjd, chains, tau_ref_epoch):
+    """
+    RA and Dec offsets of all posterior draws, computed with orbitize.kepler.calc_orbit
+    the way whereistheplanet did before it had its own orbit solver
+    """
+    import orbitize.kepler as kepler
+
+    if planet_name not in witp.multi_dict:
+        sma, ecc, inc, aop, pan, tau, plx, mtot = chains[:, :8].T
+        if planet_name in witp.dyn_mass_single_comp:
+            mtot = np.sum(chains[:, [-2, -1]], axis=1)
+
+        ras, decs, vzs = kepler.calc_orbit(date_mjd, sma, ecc, inc, aop, pan, tau, plx, mtot,
+                                           tau_ref_epoch=tau_ref_epoch)
+        return ras, decs
+
+    planet_num, tot_planets = witp.multi_dict[planet_name]
+    plx = chains[:, 6 * tot_planets]
+    mass_planets = chains[:, -1-tot_planets:-1]
+    mass_star = chains[:, -1]
+
+    all_pl_smas = chains[0, 0:6*tot_planets:6]
+    within_orbit = np.where(all_pl_smas <= all_pl_smas[planet_num])[0]
+    mtot = mass_star + np.sum(mass_planets[:, within_orbit], axis=1)
+
+    sma, ecc, inc, aop, pan, tau = chains[:, 6 * planet_num:6 * planet_num + 6].T
+    ras, decs, vzs = kepler.calc_orbit(date_mjd, sma, ecc, inc, aop, pan, tau, plx, mtot,
+                                       tau_ref_epoch=tau_ref_epoch)
+
+    # add perturbation from other planets
+    for inner_pl in within_orbit:
+        if inner_pl == planet_num:
+            continue
+
+        within_inner_orbit = np.where(all_pl_smas < all_pl_smas[inner_pl])[0]
+        inner_mtot = mass_star + np.sum(mass_planets[:, within_inner_orbit], axis=1)
+        mass_inner = mass_planets[:, inner_pl]
+
+        sma, ecc, inc, aop, pan, tau = chains[:, 6 * inner_pl:6 * inner_pl + 6].T
+        inner_ras, inner_decs, inner_vzs = kepler.calc_orbit(date_mjd, sma, ecc, inc, aop, pan, tau, plx, inner_mtot,
+                                                             tau_ref_epoch=tau_ref_epoch)
+        ras += mass_inner / inner_mtot * inner_ras
+        decs += mass_inner / inner_mtot * inner_decs
+
+    return ras, decs
+
+def test_multi_planet_predictions():
+    """
+    Test predictions for multi-planet and dynamical mass fits against orbitize on synthetic chains
+    """
+    rng = np.random.default_rng(3)
+    num = 2000
+    date_mjd = 60000.5
+    tau_ref_epoch = 58849.
+
+    # HR 8799 layout: sma, ecc, inc, aop, pan, tau of each planet, then plx, planet masses, stellar mass
+    hr8799_chains = []
+    for sma in (70, 40, 27, 16):
+        hr8799_chains += [rng.normal(sma, 1, num), rng.uniform(0, 0.3, num), rng.uniform(0.4, 0.6, num),
+                          rng.uniform(0, 2 * np.pi, num), rng.uniform(0, np.pi, num), rng.uniform(0, 1, num)]
+    hr8799_chains += [rng.normal(24.2, 0.1, num)]
+    hr8799_chains += [rng.uniform(0.005, 0.01, num) for _ in range(4)]
+    hr8799_chains += [rng.normal(1.5, 0.05, num)]
+    hr8799_chains = np.column_stack(hr8799_chains)
+
+    # single companion with a dynamical mass: the last two columns are the masses to sum
+    dyn_mass_chains = np.column_stack([rng.normal(7, 0.2, num), rng.uniform(0.4, 0.6, num),
+                                       rng.uniform(0.9, 1.1, num), rng.uniform(0, 2 * np.pi, num),
+                                       rng.uniform(0, np.pi, num), rng.uniform(0, 1, num),
+                                       rng.normal(38, 0.1, num), rng.normal(0.98, 0.02, num),
+                                       rng.normal(0.07, 0.005, num)])
+
+    for name, chains in (("hr8799b", hr8799_chains), ("hr8799c", hr8799_chains), ("hr8799d", hr8799_chains),
+                         ("hr8799e", hr8799_chains), ("hd72946b", dyn_mass_chains)):
+        # compare at the precision the chains are stored at
+        chains = chains.astype(np.float32).astype(float)
+
+        ras, decs = calc_baseline_offsets(name, date_mjd, chains, tau_ref_epoch)
+        seps = np.sqrt(ras**2 + decs**2)
+        pas = np.degrees(np.arctan2(ras, decs)) % 360
+
+        predictions = witp.print_prediction(name, date_mjd, chains, tau_ref_epoch, num_samples=None)
+        for (median, std), arr in zip(predictions, (ras, decs, seps, pas)):
+            assert np.isclose(median, np.median(arr), rtol=0, atol=1e-3)
+            assert np.isclose(std, np.std(arr), rtol=0, atol=1e-3)
+
+def test_invalid_num_samples():
+    """
+    Test that asking for fewer than one sample raises an error
+    """
+    for num_samples in (0, -5):
+        with pytest.raises(ValueError):
+            witp.thin_chains(100, num_samples)
+
 if __name__ == "__main__":
     test_all_predictions()
 
@@ -0,0 +1,149 @@
+"""
+Numba kernels for predicting where a planet is from its orbital elements.
+These are kept out of whereistheplanet.py so that listing the supported orbits
+doesn't have to import numba.
+"""
+import math
+
+import numpy as np
+import numba
+
+# orbital period [day] of a 1 au orbit around 1 Msun, and sqrt(G Msun / au) [km/s]
+# (astropy constants), so the kernel below doesn't need astropy units
+period_1au_1msun = 365.2568983840419
+vel_1au_1msun = 29.784691829676934
+
+# fixed number of Newton iterations for Kepler's equation. Starting from Danby's guess,
+# this converges to well within float32 precision for eccentricities up to ~0.999
+num_kepler_iter = 10
+
+# the orbital elements are stored in single precision, but the epochs, the arithmetic and the
+# resulting offsets are double precision, so that wide orbits keep sub-mas resolution. The elements
+# are typed as read-only, which also accepts writable arrays, as the cached ones are read-only
+float64_array = numba.float64[::1]
+readonly_float32_array = numba.types.Array(numba.float32, 1, 'C', readonly=True)
+calc_orbit_signature = numba.types.UniTuple(float64_array, 3)(numba.float64, *[readonly_float32_array] * 11,
+                                                              numba.float64)
+
+@numba.njit(calc_orbit_signature, fastmath=True, cache=True)
+def calc_orbit_numba(date_mjd, sma, ecc, sin_inc, cos_inc, sin_aop, cos_aop, sin_pan, cos_pan,
+                     tau, plx, mtot, tau_ref_epoch):
+    """
+    Numba version of orbitize.kepler.calc_orbit for a single epoch. Solves Kepler's equation
+    and rotates the orbit onto the sky in one pass over the samples.
+
+    Args:
+        date_mjd (float): MJD of date for which we want a prediction
+        sma, ecc, ..., mtot (np.array): orbital elements of N samples, with the angles given as
+            their sines and cosines (see whereistheplanet.OrbitElements)
+        tau_ref_epoch (float): MJD for reference epoch of tau
+
+    Returns:
+        raoff (np.array): RA offsets [mas]
+        deoff (np.array): Dec offsets [mas]
+        vz (np.array): radial velocity of the planet [km/s]
+    """
+    num = sma.shape[0]
+    raoff = np.empty(num, dtype=np.float64)
+    deoff = np.empty(num, dtype=np.float64)
+    vz = np.empty(num, dtype=np.float64)
+
+    for i in range(num):
+        a = np.float64(sma[i])
+        e = np.float64(ecc[i])
+
+        # mean anomaly. The epochs can be many orbits from tau_ref_epoch
+        period = period_1au_1msun * math.sqrt(a**3 / mtot[i])
+        frac_date = (date_mjd - tau_ref_epoch) / period
+        frac_date -= math.floor(frac_date)
+        manom = 2 * math.pi * (frac_date - tau[i])
+        manom -= 2 * math.pi * math.floor(manom / (2 * math.pi))
+
+        # eccentric anomaly
+        eanom = manom + 0.85 * e * math.copysign(1.0, math.sin(manom))
+        for _ in range(num_kepler_iter):
+            eanom -= (eanom - e * math.sin(eanom) - manom) / (1.0 - e * math.cos(eanom))
+        cos_e = math.cos(eanom)
+        sin_e = math.sin(eanom)
+
+        # position in the orbital plane, x towards periastron [au]
+        sqrt_1me2 = math.sqrt(1.0 - e**2)
+        x = a * (cos_e - e)
+        y = a * sqrt_1me2 * sin_e
+
+        # rotate by aop, inc, pan onto the sky
+        cos_i = cos_inc[i]
+        sin_i = sin_inc[i]
+        cos_w = cos_aop[i]
+        sin_w = sin_aop[i]
+        cos_o = cos_pan[i]
+        sin_o = sin_pan[i]
+
+        r_cos_u = x * cos_w - y * sin_w
+        r_sin_u = x * sin_w + y * cos_w
+        raoff[i] = plx[i] * (r_sin_u * cos_o * cos_i + r_cos_u * sin_o)
+        deoff[i] = plx[i] * (r_cos_u * cos_o - r_sin_u * sin_o * cos_i)
+
+        # radial velocity, using cos(aop + tanom) = r_cos_u / r
+        kv = vel_1au_1msun * math.sqrt(mtot[i] / a) / sqrt_1me2 * sin_i
+        vz[i] = kv * (e * cos_w + r_cos_u / (a * (1.0 - e * cos_e)))
+
+    return raoff, deoff, vz
+
+summarize_signature = numba.types.UniTuple(float64_array, 2)(float64_array, float64_array, float64_array)
+
+@numba.njit(summarize_signature, fastmath=True, cache=True)
+def summarize_numba(raoff, deoff, vz):
+    """
+    Computes the separations and PAs, and the median and stddev of the RA offset, Dec offset,
+    separation, PA, and RV. The means are accumulated in one pass over the samples and the squared
+    deviations from them in a second, which stays accurate for large offsets with a small spread.
+
+    Args:
+        raoff (np.array): RA offsets of N samples [mas]
+        deoff (np.array): Dec offsets of N samples [mas]
+        vz (np.array): radial velocities of N samples [km/s]
+
+    Returns:
+        medians (np.array): median RA offset, Dec offset, separation, PA, and RV
+        stds (np.array): stddev of RA offset, Dec offset, separation, PA, and RV
+    """
+    num = raoff.shape[0]
+    sep = np.empty(num, dtype=raoff.dtype)
+    pa = np.empty(num, dtype=raoff.dtype)
+
+    sum_ra = sum_dec = sum_sep = sum_pa = sum_vz = 0.0
+    for i in range(num):
+        ra = raoff[i]
+        dec = deoff[i]
+        sep[i] = math.sqrt(ra**2 + dec**2)
+        # wrap PA into [0, 360) with floor rather than a branching modulo
+        pa_i = math.atan2(ra, dec) * (180.0 / math.pi)
+        pa[i] = pa_i - 360.0 * math.floor(pa_i * (1.0 / 360.0))
+
+        sum_ra += ra
+        sum_dec += dec
+        sum_sep += sep[i]
+        sum_pa += pa[i]
+        sum_vz += vz[i]
+
+    mean_ra = sum_ra / num
+    mean_dec = sum_dec / num
+    mean_sep = sum_sep / num
+    mean_pa = sum_pa / num
+    mean_vz = sum_vz / num
+
+    sum2_ra = sum2_dec = sum2_sep = sum2_pa = sum2_vz = 0.0
+    for i in range(num):
+        sum2_ra += (raoff[i] - mean_ra)**2
+        sum2_dec += (deoff[i] - mean_dec)**2
+        sum2_sep += (sep[i] - mean_sep)**2
+        sum2_pa += (pa[i] - mean_pa)**2
+        sum2_vz += (vz[i] - mean_vz)**2
+
+    stds = np.sqrt(np.array([sum2_ra, sum2_dec, sum2_sep, sum2_pa, sum2_vz]) / num)
+
+    # numba's median is a quickselect, so this is O(N) per array
+    medians = np.array([np.median(raoff), np.median(deoff), np.median(sep), np.median(pa), np.median(vz)])
+
+    return medians, stds
@@ -1,19 +1,22 @@
 import os
+import sys
+import functools
+import collections
 import argparse
 import warnings
 warnings.filterwarnings("ignore")
 
 import numpy as np
-import h5py
-from astropy.time import Time
-
-import orbitize.kepler as kepler
-import orbitize.results as results
 
 moduledir = os.path.dirname(__file__)
 basedir = os.path.dirname(moduledir) # up one leve
 datadir = os.path.join(basedir, "data")
 
+if __name__ == "__main__":
+    # run as a script, so this file's directory is on the path rather than the repository root, and
+    # 'whereistheplanet' would find this file instead of the package
+    sys.path.insert(0, os.path.abspath(basedir))
+
 # name of all of the posteriors and reference
 post_dict = {'hr8799b' : ("post_hr8799.hdf5", "GRAVITY (unpublished)"),
              'hr8799c' : ("post_hr8799.hdf5", "GRAVITY (unpublished)"),
@@ -127,6 +130,27 @@ try:
 except:
     pass
 
+def thin_chains(num_chains, num_samples):
+    """
+    Return which posterior draws to use for a prediction
+
+    Args:
+        num_chains (int): number of posterior draws N
+        num_samples (int): number of samples for prediction. If None, will use all of them
+
+    Returns:
+        draws (slice): num_samples draws evenly spaced through the chains
+    """
+    if num_samples is None:
+        return slice(None)
+
+    if num_samples < 1:
+        raise ValueError("Number of samples must be at least 1, got {0}".format(num_samples))
+
+    # the posterior draws are already random, so thinning the chains is as good as randomly drawing
+    # from them, and reads contiguous blocks of memory instead of gathering scattered samples
+    stride = max(num_chains // num_samples, 1)
+    return slice(0, stride * num_samples, stride)
 
 def print_prediction(planet_name, date_mjd, chains, tau_ref_epoch, num_samples=None):
     """
@@ -138,7 +162,7 @@ def print_prediction(planet_name, date_mjd, chains, tau_ref_epoch, num_samples=N
         chains (np.array): Nx8 array of N orbital elements. Orbital elements are ordered as:
                             sma, ecc, inc, aop, pan, tau, plx, mtot
         tau_ref_epoch (float): MJD for reference epoch of tau (see orbitize for details on tau)
-        num_samples (int): number of random samples for prediction. If None, will use all of them
+        num_samples (int): number of samples for prediction, evenly spaced through the chains. If None, will use all of them
 
     Returns:
         ra_args (tuple): a two-element tuple of the median RA offset, and stddev of RA offset
@@ -146,81 +170,56 @@ def print_prediction(planet_name, date_mjd, chains, tau_ref_epoch, num_samples=N
         sep_args (tuple): a two-element tuple of the median separation offset, and stddev of sep offset
         pa_args (tuple): a two-element tuple of the median PA offset, and stddev of PA offset
     """
+    rand_orbits = chains[thin_chains(chains.shape[0], num_samples)]
 
-    if num_samples is None:
-        num_samples = chains.shape[0]
-        rand_draws = np.arange(num_samples) # don't need to randomize
-    else:
-        # if num_samples > chains.shape[0]:
-        #     print("Requested too many samples. Maximum is {0}.".format(chains.shape[0]))
-        #     return
-    
-        # randomly draw values
-        rand_draws = np.random.randint(0, chains.shape[0], num_samples)
-
-    planet_name = planet_name.lower()
+    elements = chains_to_orbit_elements(planet_name, rand_orbits)
 
-    rand_orbits = chains[rand_draws]
+    return print_elements_prediction(date_mjd, elements, tau_ref_epoch)
 
-    if planet_name not in multi_dict:
-        # single Keplerian orbit fits
-        sma = rand_orbits[:, 0]
-        ecc = rand_orbits[:, 1]
-        inc = rand_orbits[:, 2]
-        aop = rand_orbits[:, 3]
-        pan = rand_orbits[:, 4]
-        tau = rand_orbits[:, 5]
-        plx = rand_orbits[:, 6]
-        mtot = rand_orbits[:, 7]
+def print_elements_prediction(date_mjd, elements, tau_ref_epoch, num_samples=None):
+    """
+    Same as print_prediction, but for orbital elements that have already been unpacked from the chains
 
-        if planet_name in dyn_mass_single_comp:
-            mtot = np.sum(rand_orbits[:,[-2,-1]], axis=1)
+    Args:
+        date_mjd (float): MJD of date for which we want a prediction
+        elements (OrbitElements): orbital elements of the N posterior draws (see get_orbit_elements)
+        tau_ref_epoch (float): MJD for reference epoch of tau (see orbitize for details on tau)
+        num_samples (int): number of samples for prediction, evenly spaced through the chains. If None, will use all of them
 
-        rand_ras, rand_decs, rand_vzs = kepler.calc_orbit(date_mjd, sma, ecc, inc, aop, pan, tau, plx, mtot,
-                                                        tau_ref_epoch=tau_ref_epoch)
-    else:
-        # massive multi-planet orbit fits
-        planet_num, tot_planets = multi_dict[planet_name]
-        orb_indices = np.arange(6 * planet_num, 6 * planet_num+6, 1)
-        sma, ecc, inc, aop, pan, tau = rand_orbits[:, orb_indices].T
-        plx = rand_orbits[:, 6 * tot_planets]
-        mass_planets = rand_orbits[:, -1-tot_planets:-1]
-        mass_star = rand_orbits[:, -1]
+    Returns:
+        ra_args (tuple): a two-element tuple of the median RA offset, and stddev of RA offset
+        dec_args (tuple): a two-element tuple of the median Dec offset, and stddev of Dec offset
+        sep_args (tuple): a two-element tuple of the median separation offset, and stddev of sep offset
+        pa_args (tuple): a two-element tuple of the median PA offset, and stddev of PA offset
+    """
+    # only import numba when we actually need to predict something
+    import whereistheplanet.orbit_kernels as orbit_kernels
 
-        all_pl_smas = rand_orbits[0, 0:6*tot_planets:6]
-        within_orbit = np.where(all_pl_smas <= all_pl_smas[planet_num])
-        mtot = mass_star + np.sum(mass_planets[:, within_orbit[0]], axis=1)
+    num_chains = elements.sma.shape[1]
 
-        rand_ras, rand_decs, rand_vzs = kepler.calc_orbit(date_mjd, sma, ecc, inc, aop, pan, tau, plx, mtot,
-                                                        tau_ref_epoch=tau_ref_epoch)
+    rand_draws = thin_chains(num_chains, num_samples)
+    num_samples = len(range(num_chains)[rand_draws])
 
-        # add perturbation from other planets
-        for inner_pl in within_orbit[0]:
-            if inner_pl == planet_num:
-                continue
-            
-            within_inner_orbit = np.where(all_pl_smas < all_pl_smas[inner_pl])
-            inner_mtot = mass_star + np.sum(mass_planets[:, within_inner_orbit[0]], axis=1)
-            mass_inner = mass_planets[:, inner_pl]
+    rand_ras = np.zeros(num_samples)
+    rand_decs = np.zeros(num_samples)
+    rand_vzs = np.zeros(num_samples)
 
-            inner_orb_indices = np.arange(6 * inner_pl, 6 * inner_pl + 6, 1)
-            in_sma, in_ecc, in_inc, in_aop, in_pan, in_tau = rand_orbits[:, inner_orb_indices].T
+    # the orbit of the planet itself, plus the perturbation from planets within its orbit
+    for orb in range(elements.sma.shape[0]):
+        orb_elements = [np.ascontiguousarray(field[orb, rand_draws]) for field in elements]
+        sma, ecc, sin_inc, cos_inc, sin_aop, cos_aop, sin_pan, cos_pan, tau, plx, mtot, weight = orb_elements
 
-            inner_rand_ras, inner_rand_decs, inner_rand_vzs = kepler.calc_orbit(date_mjd, in_sma, in_ecc, in_inc, in_aop, in_pan, in_tau, plx, inner_mtot,
-                                                          tau_ref_epoch=tau_ref_epoch)
+        orb_ras, orb_decs, orb_vzs = orbit_kernels.calc_orbit_numba(float(date_mjd), sma, ecc, sin_inc, cos_inc,
+                                                                    sin_aop, cos_aop, sin_pan, cos_pan, tau, plx, mtot,
+                                                                    float(tau_ref_epoch))
 
-            rand_ras += mass_inner/inner_mtot * inner_rand_ras
-            rand_decs += mass_inner/inner_mtot * inner_rand_decs
-            rand_vzs += mass_inner/inner_mtot * inner_rand_vzs
+        rand_ras += weight * orb_ras
+        rand_decs += weight * orb_decs
+        rand_vzs += weight * orb_vzs
 
-    rand_seps = np.sqrt(rand_ras**2 + rand_decs**2)
-    rand_pas = np.degrees(np.arctan2(rand_ras, rand_decs)) % 360
+    medians, stds = orbit_kernels.summarize_numba(rand_ras, rand_decs, rand_vzs)
 
-    ra_args = np.median(rand_ras), np.std(rand_ras)
-    dec_args = np.median(rand_decs), np.std(rand_decs)
-    sep_args = np.median(rand_seps), np.std(rand_seps)
-    pa_args = np.median(rand_pas), np.std(rand_pas)
-    rv_args = np.median(rand_vzs), np.std(rand_vzs)
+    ra_args, dec_args, sep_args, pa_args, rv_args = zip(medians, stds)
 
     print("RA Offset = {0:.3f} +/- {1:.3f} mas".format(ra_args[0], ra_args[1]))
     print("Dec Offset = {0:.3f} +/- {1:.3f} mas".format(dec_args[0], dec_args[1]))
@@ -241,6 +240,35 @@ def print_supported_orbits():
         print("    {0} ({1})".format(name, reference))
     return
 
+@functools.lru_cache(maxsize=None)
+def load_posterior(filename):
+    """
+    Load a posterior file from the data directory. The result is cached, so planets that share
+    an orbit fit (e.g., the HR 8799 planets) only read the file once.
+
+    Args:
+        filename (str): name of the posterior file in the data directory
+
+    Returns:
+        post (np.array): read-only float32 array of the posterior draws
+        tau_ref_epoch (float): MJD for reference tau epoch
+    """
+    import h5py
+
+    filepath = os.path.join(datadir, filename)
+    with h5py.File(filepath,'r') as hf: # Opens file for reading
+        # read straight into a single precision buffer, which is plenty for predictions
+        # reported to a few decimal places
+        dataset = hf['post']
+        post = np.empty(dataset.shape, dtype=np.float32)
+        dataset.read_direct(post)
+        # old orbitize results files without a reference epoch had it fixed at MJD = 0
+        tau_ref_epoch = float(hf.attrs.get('tau_ref_epoch', 0))
+    # shared between all callers, so don't let anyone modify it
+    post.flags.writeable = False
+
+    return post, tau_ref_epoch
+
 def get_chains(planet_name):
     """
     Return posteriors for a given planet name
@@ -249,7 +277,7 @@ def get_chains(planet_name):
         planet_name (str): name of planet. no space
 
     Returns:
-        chains (np.array): Nx8 array of N posterior draws
+        chains (np.array): Nx8 read-only float32 array of N posterior draws
         tau_ref_epoch (float): MJD for reference tau epoch
     """
     planet_name = planet_name.lower()
@@ -258,19 +286,98 @@ def get_chains(planet_name):
         raise ValueError("Invalid planet name '{0}'".format(planet_name))
     
     filename, reference = post_dict[planet_name]
-    filepath = os.path.join(datadir, filename)
-    try:
-        res = results.Results()
-        res.load_results(filepath)
-        post = res.post
-        tau_ref_epoch = res.tau_ref_epoch
-    except KeyError:
-        with h5py.File(filepath,'r') as hf: # Opens file for reading
-            post = np.array(hf.get('post'))
-            tau_ref_epoch = float(hf.attrs['tau_ref_epoch'])
-    post = np.array(post, dtype=float)
 
-    return post, tau_ref_epoch
+    return load_posterior(filename)
+
+# orbital elements in the order taken by orbit_kernels.calc_orbit_numba. Each field is a (M, N) array for the
+# N posterior draws of the M orbits that make up the planet's motion: the orbit of the planet itself,
+# followed by any inner planets that perturb it, each scaled by weight
+OrbitElements = collections.namedtuple("OrbitElements", ["sma", "ecc", "sin_inc", "cos_inc", "sin_aop", "cos_aop",
+                                                         "sin_pan", "cos_pan", "tau", "plx", "mtot", "weight"])
+
+@functools.lru_cache(maxsize=None)
+def get_orbit_elements(planet_name):
+    """
+    Return the orbital elements for a given planet name, with the sine and cosine of the angles
+    precomputed. The result is cached, so the posteriors are only loaded once.
+
+    Args:
+        planet_name (str): name of planet. no space
+
+    Returns:
+        elements (OrbitElements): orbital elements of the N posterior draws
+        tau_ref_epoch (float): MJD for reference tau epoch
+    """
+    chains, tau_ref_epoch = get_chains(planet_name)
+
+    elements = chains_to_orbit_elements(planet_name, chains)
+    # shared between all callers, so don't let anyone modify it
+    for field in elements:
+        field.flags.writeable = False
+
+    return elements, tau_ref_epoch
+
+def chains_to_orbit_elements(planet_name, chains):
+    """
+    Unpack the orbital elements of a planet from its posterior draws, with the sine and cosine
+    of the angles precomputed
+
+    Args:
+        planet_name (str): name of planet. no space
+        chains (np.array): Nx8 array of N posterior draws (see get_chains)
+
+    Returns:
+        elements (OrbitElements): float32 orbital elements of the N posterior draws
+    """
+    planet_name = planet_name.lower()
+
+    # transpose once so each orbital parameter is contiguous in memory, rather than
+    # a strided column of the chains
+    params = np.ascontiguousarray(chains.T, dtype=np.float32)
+    num_draws = params.shape[1]
+
+    if planet_name not in multi_dict:
+        # single Keplerian orbit fits
+        sma, ecc, inc, aop, pan, tau, plx, mtot = params[:8]
+
+        if planet_name in dyn_mass_single_comp:
+            mtot = params[-2] + params[-1]
+
+        orbits = [(sma, ecc, inc, aop, pan, tau, plx, mtot, np.ones(num_draws, dtype=params.dtype))]
+    else:
+        # massive multi-planet orbit fits
+        planet_num, tot_planets = multi_dict[planet_name]
+        sma, ecc, inc, aop, pan, tau = params[6 * planet_num:6 * planet_num + 6]
+        plx = params[6 * tot_planets]
+        mass_planets = params[-1-tot_planets:-1]
+        mass_star = params[-1]
+
+        all_pl_smas = params[0:6*tot_planets:6, 0]
+        within_orbit = np.where(all_pl_smas <= all_pl_smas[planet_num])
+        mtot = mass_star + np.sum(mass_planets[within_orbit[0]], axis=0)
+
+        orbits = [(sma, ecc, inc, aop, pan, tau, plx, mtot, np.ones(num_draws, dtype=params.dtype))]
+
+        # add perturbation from other planets
+        for inner_pl in within_orbit[0]:
+            if inner_pl == planet_num:
+                continue
+
+            within_inner_orbit = np.where(all_pl_smas < all_pl_smas[inner_pl])
+            inner_mtot = mass_star + np.sum(mass_planets[within_inner_orbit[0]], axis=0)
+            mass_inner = mass_planets[inner_pl]
+
+            in_sma, in_ecc, in_inc, in_aop, in_pan, in_tau = params[6 * inner_pl:6 * inner_pl + 6]
+
+            orbits.append((in_sma, in_ecc, in_inc, in_aop, in_pan, in_tau, plx, inner_mtot, mass_inner/inner_mtot))
+
+    sma, ecc, inc, aop, pan, tau, plx, mtot, weight = [np.array(param) for param in zip(*orbits)]
+
+    elements = OrbitElements(sma=sma, ecc=ecc, sin_inc=np.sin(inc), cos_inc=np.cos(inc),
+                             sin_aop=np.sin(aop), cos_aop=np.cos(aop), sin_pan=np.sin(pan), cos_pan=np.cos(pan),
+                             tau=tau, plx=plx, mtot=mtot, weight=weight)
+
+    return elements
 
 def get_reference(planet_name):
     """
@@ -305,6 +412,8 @@ def predict_planet(planet_name, time_mjd=None, num_samples=100):
         sep_args (tuple): a two-element tuple of the median separation offset, and stddev of sep offset
         pa_args (tuple): a two-element tuple of the median PA offset, and stddev of PA offset
     """
+    from astropy.time import Time
+
     if time_mjd is None:
         # use the current time
         time_mjd = Time.now().mjd
@@ -320,9 +429,9 @@ def predict_planet(planet_name, time_mjd=None, num_samples=100):
     planet_name = planet_name.lower()
 
     # do real stuff
-    chains, tau_ref_epoch = get_chains(planet_name)
+    elements, tau_ref_epoch = get_orbit_elements(planet_name)
 
-    ra_args, dec_args, sep_args, pa_args = print_prediction(planet_name, time_mjd, chains, tau_ref_epoch, num_samples=num_samples)
+    ra_args, dec_args, sep_args, pa_args = print_elements_prediction(time_mjd, elements, tau_ref_epoch, num_samples=num_samples)
 
     return ra_args, dec_args, sep_args, pa_args
 
@@ -348,7 +457,9 @@ def main():
         print_supported_orbits()
 
     else:
-        # perform regular functionality.
+        # perform regular functionality. astropy is slow to import, so only do it here
+        from astropy.time import Time
+
         if args.time is None:
             # use the current time
             time_mjd = Time.now().mjd